@@ -1,12 +1,253 @@
 import streamlit as st
 import os
 import re
+import regex
 import json
 import time
+import pickle
 import random
-from datetime import datetime
-from typing import Dict, List, Any, Optional
-from openai import OpenAI
+import shutil
+import socket
+import uuid
+import warnings
+import weakref
+from abc import ABC, abstractmethod
+from collections import deque
+from itertools import islice
+from typing import TYPE_CHECKING, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+try:
+    from re import _parser as sre_parse  # Python 3.11+
+except ImportError:
+    import sre_parse
+
+# Optional: scan built-in rules with Intel Hyperscan when it is installed
+try:
+    import hyperscan
+except ImportError:
+    hyperscan = None
+
+if TYPE_CHECKING:
+    from openai import OpenAI
+
+# Where conversation history is kept: "memory", "disk" or "s3" (needs the
+# optional boto3 package)
+CACHE_STRATEGY = os.getenv("CACHE_STRATEGY", "memory")
+CACHE_DIR = os.getenv("CACHE_DIR", ".chat_history")
+CACHE_MAX_AGE = float(os.getenv("CACHE_MAX_AGE", 24 * 60 * 60))  # Seconds before orphaned disk logs are swept
+S3_BUCKET = os.getenv("S3_BUCKET")
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL")  # e.g. a Minio server
+HISTORY_WINDOW = 20  # Messages kept in memory and shown at once
+
+
+class ConversationStore(ABC):
+    """Conversation history that keeps recent messages in memory and spills the rest to a backend."""
+
+    def __init__(self, memory_limit: Optional[int] = HISTORY_WINDOW):
+        self._recent = deque(maxlen=memory_limit)
+        self._count = 0
+
+    def __len__(self) -> int:
+        return self._count
+
+    def append(self, message: Dict) -> None:
+        """Add a message to the end of the conversation."""
+        self._persist(self._count, message)
+        self._recent.append(message)
+        self._count += 1
+
+    def tail(self, n: int) -> List[Dict]:
+        """Return the last n messages."""
+        return self.load_range(max(0, self._count - n), self._count)
+
+    def load_range(self, start: int, end: int) -> List[Dict]:
+        """Return messages start..end-1, reading from the backend if they left memory."""
+        first_recent = self._count - len(self._recent)
+        if start >= first_recent:
+            return list(islice(self._recent, start - first_recent, end - first_recent))
+
+        older = self._load(start, min(end, first_recent))
+        return older + list(islice(self._recent, 0, max(0, end - first_recent)))
+
+    def clear(self) -> None:
+        """Remove every message."""
+        self._clear()
+        self._recent.clear()
+        self._count = 0
+
+    @abstractmethod
+    def _persist(self, index: int, message: Dict) -> None:
+        """Write message number index to the backend."""
+
+    @abstractmethod
+    def _load(self, start: int, end: int) -> List[Dict]:
+        """Read messages start..end-1 back from the backend."""
+
+    @abstractmethod
+    def _clear(self) -> None:
+        """Delete every message from the backend."""
+
+
+class MemoryConversationStore(ConversationStore):
+    """Keeps the whole conversation in memory."""
+
+    def __init__(self):
+        super().__init__(memory_limit=None)
+
+    def _persist(self, index: int, message: Dict) -> None:
+        pass
+
+    def _load(self, start: int, end: int) -> List[Dict]:
+        return []  # Nothing ever leaves memory
+
+    def _clear(self) -> None:
+        pass
+
+
+# Disk logs that belong to a live store in this process
+_open_logs = set()
+
+
+def _log_owner() -> str:
+    """Name of this process's subdirectory of CACHE_DIR."""
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+def _owner_gone(owner: str) -> bool:
+    """Whether the process owning a log subdirectory has exited.
+
+    Only processes on this host can be checked, and only on POSIX (on Windows
+    os.kill terminates the process); anything else is assumed to be alive.
+    """
+    host, _, pid = owner.rpartition("-")
+    if os.name != "posix" or host != socket.gethostname() or not pid.isdigit():
+        return False
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        pass  # Alive, but owned by another user
+    return False
+
+
+def _remove_log(path: str) -> None:
+    """Delete a disk log once its store is gone."""
+    _open_logs.discard(path)
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def _sweep_logs(directory: str, max_age: float) -> None:
+    """Delete disk logs no live store owns that haven't been written for max_age seconds.
+
+    Each process writes to its own subdirectory, so logs of another live
+    process are never touched, however long they have been idle.
+    """
+    cutoff = time.time() - max_age
+    own = _log_owner()
+    for entry in os.scandir(directory):
+        try:
+            if not entry.is_dir():
+                continue
+            if entry.name == own:
+                # Left behind by an earlier process that had the same pid
+                for log in os.scandir(entry.path):
+                    if log.name.endswith(".pkl") and log.path not in _open_logs and log.stat().st_mtime < cutoff:
+                        os.remove(log.path)
+            elif _owner_gone(entry.name) and entry.stat().st_mtime < cutoff:
+                shutil.rmtree(entry.path, ignore_errors=True)
+        except FileNotFoundError:
+            pass  # Removed by another process in the meantime
+
+
+class DiskConversationStore(ConversationStore):
+    """Spills messages to an append-only pickle log on local disk.
+
+    The log is deleted when the conversation is cleared or the session's store
+    is garbage collected. Logs left behind by a crashed process on the same
+    host are swept once they are older than CACHE_MAX_AGE; on Windows, or when
+    CACHE_DIR is shared between hosts, other processes' logs are left alone.
+    """
+
+    def __init__(self, directory: str = CACHE_DIR, max_age: float = CACHE_MAX_AGE):
+        super().__init__()
+        owner_dir = os.path.join(directory, _log_owner())
+        os.makedirs(owner_dir, exist_ok=True)
+        _sweep_logs(directory, max_age)
+
+        self.path = os.path.join(owner_dir, f"{uuid.uuid4().hex}.pkl")
+        self._offsets = []
+        _open_logs.add(self.path)
+        weakref.finalize(self, _remove_log, self.path)
+
+    def _persist(self, index: int, message: Dict) -> None:
+        with open(self.path, "ab") as f:
+            self._offsets.append(f.tell())
+            pickle.dump(message, f)
+
+    def _load(self, start: int, end: int) -> List[Dict]:
+        messages = []
+        with open(self.path, "rb") as f:
+            f.seek(self._offsets[start])
+            for _ in range(start, end):
+                messages.append(pickle.load(f))
+        return messages
+
+    def _clear(self) -> None:
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self._offsets = []
+
+
+class S3ConversationStore(ConversationStore):
+    """Spills messages to S3 (or an S3-compatible server), one object per message.
+
+    Objects are only deleted on Clear Conversation; expire old ones with a bucket
+    lifecycle rule on the conversations/ prefix.
+    """
+
+    def __init__(self, bucket: str = S3_BUCKET, endpoint_url: Optional[str] = S3_ENDPOINT_URL):
+        super().__init__()
+        if not bucket:
+            raise ValueError("CACHE_STRATEGY=s3 needs the S3_BUCKET environment variable to be set")
+        try:
+            import boto3
+        except ImportError:
+            raise ImportError("CACHE_STRATEGY=s3 needs the optional boto3 package: pip install boto3")
+
+        self.client = boto3.client("s3", endpoint_url=endpoint_url)
+        self.bucket = bucket
+        self.prefix = f"conversations/{uuid.uuid4().hex}"
+
+    def _key(self, index: int) -> str:
+        return f"{self.prefix}/{index:08d}.json"
+
+    def _persist(self, index: int, message: Dict) -> None:
+        # JSON rather than pickle: objects in a shared bucket must not be unpickled
+        self.client.put_object(Bucket=self.bucket, Key=self._key(index), Body=json.dumps(message))
+
+    def _load(self, start: int, end: int) -> List[Dict]:
+        return [
+            json.loads(self.client.get_object(Bucket=self.bucket, Key=self._key(i))["Body"].read())
+            for i in range(start, end)
+        ]
+
+    def _clear(self) -> None:
+        # delete_objects accepts at most 1000 keys per call
+        for start in range(0, self._count, 1000):
+            keys = [{"Key": self._key(i)} for i in range(start, min(start + 1000, self._count))]
+            self.client.delete_objects(Bucket=self.bucket, Delete={"Objects": keys})
+
+
+def create_conversation_store(strategy: str = CACHE_STRATEGY) -> ConversationStore:
+    """Create the conversation store for a caching strategy."""
+    if strategy == "disk":
+        return DiskConversationStore()
+    if strategy == "s3":
+        return S3ConversationStore()
+    return MemoryConversationStore()
+
 
 # Page configuration
 st.set_page_config(
@@ -17,8 +258,12 @@ st.set_page_config(
 )
 
 # Initialize session state
-if "messages" not in st.session_state:
-    st.session_state.messages = []
+if "user_count" not in st.session_state:
+    st.session_state.user_count = 0
+if "bot_count" not in st.session_state:
+    st.session_state.bot_count = 0
+if "context" not in st.session_state:
+    st.session_state.context = deque(maxlen=10)  # Last 10 messages for AI context
 if "current_bot" not in st.session_state:
     st.session_state.current_bot = "rule_based"
 if "custom_rules" not in st.session_state:
@@ -29,6 +274,14 @@ if "selected_template" not in st.session_state:
     st.session_state.selected_template = None
 if "bot_config" not in st.session_state:
     st.session_state.bot_config = {}
+if "rule_bot" not in st.session_state:
+    st.session_state.rule_bot = None
+if "ai_bot" not in st.session_state:
+    st.session_state.ai_bot = None
+if "store" not in st.session_state:
+    st.session_state.store = create_conversation_store()  # Conversation history
+if "history_window" not in st.session_state:
+    st.session_state.history_window = HISTORY_WINDOW
 
 # Pre-built chatbot templates
 CHATBOT_TEMPLATES = {
@@ -92,94 +345,470 @@ CHATBOT_TEMPLATES = {
 }
 
 
+def _compile_rules(rules: Dict[str, List[str]]) -> List[Tuple[re.Pattern, List[str]]]:
+    """Compile a pattern -> responses mapping into (regex, responses) pairs."""
+    return [(re.compile(pattern, re.IGNORECASE), responses) for pattern, responses in rules.items()]
+
+
+# Rules shaped like \bword\b or \b(word1|word2)\b can be served by a plain
+# keyword lookup instead of the regex engine
+_WORD_ALTERNATION = re.compile(r'\\b(?:\((\w+(?:\|\w+)*)\)|(\w+))\\b')
+_WORD = re.compile(r'\w+')
+
+
+def _keyword_alternatives(pattern: str) -> Optional[List[str]]:
+    """Return the literal words of a pure word-alternation pattern, or None."""
+    match = _WORD_ALTERNATION.fullmatch(pattern)
+    if not match:
+        return None
+    words = match.group(1) or match.group(2)
+    return words.lower().split("|")
+
+
+# Rules shared by every rule-based bot, compiled once at import
+_DEFAULT_RULES = _compile_rules({
+    r'\b(hello|hi|hey)\b': [
+        "Hello! How can I help you today?",
+        "Hi there! What can I do for you?",
+        "Hey! How's it going?"
+    ],
+    r'\b(bye|goodbye|see you)\b': [
+        "Goodbye! Have a great day!",
+        "See you later!",
+        "Take care!"
+    ],
+    r'\bname\b': [
+        "I'm a rule-based chatbot created to help you learn!",
+        "My name is RuleBot. Nice to meet you!"
+    ],
+    r'\b(thanks|thank you)\b': [
+        "You're welcome!",
+        "Happy to help!",
+        "No problem!"
+    ],
+    r'\b(help|what can you do)\b': [
+        "I can respond to basic greetings, questions about my name, and simple conversations!",
+        "I'm a simple rule-based bot. Try saying hello, asking my name, or saying goodbye!"
+    ]
+})
+
+# Default rules followed by each template's rules, merged once at import
+_MERGED_RULES = {
+    None: tuple(_DEFAULT_RULES),
+    **{
+        name: tuple(_DEFAULT_RULES + _compile_rules(template_data["rules"]))
+        for name, template_data in CHATBOT_TEMPLATES.items()
+    }
+}
+
+_DEFAULT_RESPONSES = (
+    "I'm not sure I understand. Can you rephrase that?",
+    "That's interesting! Tell me more.",
+    "I'm still learning. Can you ask me something else?",
+    "Hmm, I don't have a good response for that yet."
+)
+
+
+# Longer messages are truncated before matching to bound regex work
+MAX_MESSAGE_LENGTH = 4096
+
+# User patterns run on the `regex` engine, which supports match timeouts, so a
+# pathological pattern can't hang the app
+_CUSTOM_RULE_TIMEOUT = 0.05  # seconds
+_PATTERN_PROBE = "a" * 30 + " hello there, how are you doing today?!"
+
+
+def _parse_pattern(pattern: str):
+    """Parse a pattern with the stdlib regex parser, without its FutureWarnings."""
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", FutureWarning)
+        return sre_parse.parse(pattern)
+
+
+def _subpatterns(av):
+    """Yield the nested sub-patterns of a parsed regex node's argument."""
+    if isinstance(av, sre_parse.SubPattern):
+        yield av
+    elif isinstance(av, (list, tuple)):
+        for item in av:
+            yield from _subpatterns(item)
+
+
+# Escapes only the regex module understands (\\ is matched first so an escaped
+# backslash is kept). None of them repeat anything, so the lint parses the
+# pattern with a literal in their place
+_REGEX_ONLY_ESCAPE = re.compile(r"(\\\\)|\\(?:[pP]\{[^}]*\}|[pP][A-Za-z]|L<[^>]*>|[XmMGK])")
+
+
+def _parse_for_lint(pattern: str):
+    """Parse a user pattern for _validate_pattern, or return None if the stdlib parser can't."""
+    try:
+        return _parse_pattern(_REGEX_ONLY_ESCAPE.sub(lambda m: m.group(1) or "x", pattern))
+    except re.error:
+        return None
+
+
+def _validate_pattern(pattern: str) -> Optional[str]:
+    """Return why a user pattern is likely to match slowly, or None if it looks safe.
+
+    Patterns _parse_for_lint can't read pass the lint; only the match timeout
+    guards them.
+    """
+    parsed = _parse_for_lint(pattern)
+    if parsed is None:
+        return None
+
+    wildcards = 0
+
+    def walk(subpattern, repeated: bool) -> Optional[str]:
+        nonlocal wildcards
+        for op, av in subpattern:
+            if op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT):
+                _, high, body = av
+                unbounded = high == sre_parse.MAXREPEAT
+                if unbounded and repeated:
+                    return "it nests a repeat inside another repeat"
+                if unbounded and len(body) == 1 and body[0][0] == sre_parse.ANY:
+                    wildcards += 1
+                reason = walk(body, repeated or high > 1)
+            elif op == sre_parse.GROUPREF and repeated:
+                return "it repeats a backreference"
+            else:
+                reason = None
+                for child in _subpatterns(av):
+                    reason = walk(child, repeated)
+                    if reason:
+                        break
+
+            if reason:
+                return reason
+
+        return None
+
+    reason = walk(parsed, False)
+    if reason:
+        return reason
+    if wildcards > 1:
+        return "it uses more than one .* or .+"
+
+    return None
+
+
+def _compile_custom_pattern(pattern: str) -> regex.Pattern:
+    """Compile a user pattern, raising regex.error if invalid or TimeoutError if too slow."""
+    compiled = regex.compile(pattern, regex.IGNORECASE)
+    compiled.search(_PATTERN_PROBE, timeout=_CUSTOM_RULE_TIMEOUT)
+    return compiled
+
+
+# Non-ASCII characters that IGNORECASE matches to an ASCII letter but that
+# str.lower() leaves alone
+_FOLD_VARIANTS = {"i": "ı", "s": "ſ"}
+
+
+def _plain_char(code: int) -> Optional[str]:
+    """Return a literal as a lowercase ASCII letter or digit, or None for anything else."""
+    char = chr(code)
+    return char.lower() if char.isascii() and char.isalnum() else None
+
+
+def _first(subpattern) -> Optional[Tuple[set, bool]]:
+    """Return (possible first characters, can be empty) for a parsed pattern, or None."""
+    chars = set()
+    for op, av in subpattern:
+        if op == sre_parse.AT:
+            continue  # Anchors like \b don't consume a character
+        if op == sre_parse.LITERAL:
+            char = _plain_char(av)
+            if char is None:
+                return None
+            chars.add(char)
+            return chars, False
+        if op == sre_parse.IN:
+            if any(item_op != sre_parse.LITERAL for item_op, _ in av):
+                return None
+            members = [_plain_char(item_av) for _, item_av in av]
+            if None in members:
+                return None  # e.g. a POSIX class like [[:digit:]] parsed as a plain set
+            chars.update(members)
+            return chars, False
+
+        if op == sre_parse.SUBPATTERN:
+            first = _first(av[-1])
+        elif op == sre_parse.BRANCH:
+            branches = [_first(branch) for branch in av[1]]
+            if None in branches:
+                return None
+            first = (set().union(*(b[0] for b in branches)), any(b[1] for b in branches))
+        elif op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT):
+            low, _, body = av
+            first = _first(body)
+            if first is not None:
+                first = (first[0], first[1] or low == 0)
+        else:
+            return None
+
+        if first is None:
+            return None
+        chars |= first[0]
+        if not first[1]:
+            return chars, False
+
+    return chars, True
+
+
+def _first_chars(pattern: str) -> Optional[frozenset]:
+    """Return the lowercase characters a match of pattern must start with, or None if any.
+
+    Only plain ASCII letters and digits are trusted, since custom rules run on the
+    regex engine, which reads some syntax differently from the stdlib parser.
+    """
+    # Braces may be fuzzy-matching constraints or \p{...} / \N{...} in regex
+    if "{" in pattern:
+        return None
+    try:
+        first = _first(_parse_pattern(pattern))
+    except re.error:
+        return None
+    if first is None or first[1]:
+        return None
+    return frozenset(first[0]).union(*(_FOLD_VARIANTS.get(char, "") for char in first[0]))
+
+
+def _compile_template(
+    rules: Sequence[Tuple[re.Pattern, List[str]]],
+    custom_rules: List[Tuple[regex.Pattern, List[str]]] = ()
+) -> Callable[[str], Optional[List[str]]]:
+    """Build a matcher returning the responses of the rule a message hits, or None.
+
+    Among built-in rules the one that occurs first in the message wins, and rule
+    order breaks ties:
+
+    >>> _TEMPLATE_MATCHERS["customer_support"]("thanks for tracking my order")[0]
+    "You're welcome!"
+    >>> _TEMPLATE_MATCHERS["customer_support"]("goodbye, I will check my order later")[0]
+    'Goodbye! Have a great day!'
+    >>> _TEMPLATE_MATCHERS["restaurant_bot"]("see you tomorrow, book a table")[0]
+    'Goodbye! Have a great day!'
+    >>> _TEMPLATE_MATCHERS["customer_support"]("where is my order? thanks")[0]
+    'I can help you track your order! Please provide your order number.'
+    """
+    # Word-alternation rules go into a keyword table, the rest into a regex.
+    # Both keep their rule index so ties can be broken by rule order
+    keyword_map = {}
+    pairs = []
+    for index, (pattern, responses) in enumerate(rules):
+        keywords = _keyword_alternatives(pattern.pattern)
+        if keywords is None:
+            pairs.append((index, pattern, responses))
+        else:
+            for keyword in keywords:
+                keyword_map.setdefault(keyword, (index, responses))
+
+    # Union the regex rules into one alternation so a message is scanned once
+    combined = re.compile(
+        "|".join(f"(?P<g{i}>{pattern.pattern})" for i, (_, pattern, _) in enumerate(pairs)),
+        re.IGNORECASE
+    ) if pairs else None
+    combined_first = _first_chars(combined.pattern) if combined else None
+
+    # Hyperscan compiles the same rules into one DFA and rejects messages no rule
+    # can match. UCP gives \b and \w the same Unicode meaning as re, but Hyperscan
+    # only accepts \b under UCP as a prefilter, so a hit is confirmed with re below
+    database = None
+    flags = (hyperscan.HS_FLAG_CASELESS | hyperscan.HS_FLAG_UTF8 | hyperscan.HS_FLAG_UCP
+             | hyperscan.HS_FLAG_PREFILTER | hyperscan.HS_FLAG_SINGLEMATCH) if hyperscan else 0
+    if hyperscan and pairs:
+        try:
+            database = hyperscan.Database()
+            database.compile(
+                expressions=[pattern.pattern.encode() for _, pattern, _ in pairs],
+                ids=list(range(len(pairs))),
+                elements=len(pairs),
+                flags=[flags] * len(pairs)
+            )
+        except hyperscan.error:
+            database = None  # Syntax hyperscan doesn't support
+
+    # Shard custom rules by the characters a match can start with, so only rules
+    # whose first character appears in the message are tried
+    by_first = {}
+    always = []
+    for i, (pattern, _) in enumerate(custom_rules):
+        first = _first_chars(pattern.pattern)
+        if first is None:
+            always.append(i)
+        else:
+            for char in first:
+                by_first.setdefault(char, []).append(i)
+
+    def scan(message: str) -> Optional[Tuple[int, int, List[str]]]:
+        """Return (start, rule index, responses) of the leftmost regex-rule hit, or None."""
+        if database is not None:
+            def on_match(pair_id, start, end, flags, context):
+                return True  # One possible hit is enough; stop scanning
+
+            try:
+                database.scan(message.encode(), match_event_handler=on_match)
+                return None  # No rule can match
+            except hyperscan.ScanTerminated:
+                pass  # Some rule may match; the regex finds the leftmost in one pass
+            except hyperscan.ScratchInUseError:
+                pass  # Another session is scanning the shared database; use the regex
+
+        found = combined.search(message)
+        if not found:
+            return None
+        index, _, responses = pairs[int(found.lastgroup[1:])]
+        return found.start(), index, responses
+
+    def match(message: str) -> Optional[List[str]]:
+        # Keyword and regex rules compete on where they occur in the message
+        best = None
+        for token in _WORD.finditer(message):
+            hit = keyword_map.get(token.group().lower())
+            if hit is not None:
+                best = (token.start(), *hit)
+                break
+
+        letters = set(message.lower())
+
+        if combined and (combined_first is None or not combined_first.isdisjoint(letters)):
+            hit = scan(message)
+            if hit is not None and (best is None or hit[:2] < best[:2]):
+                best = hit
+
+        if best is not None:
+            return best[2]
+
+        if not custom_rules:
+            return None
+
+        candidates = set(always)
+        for char in letters.intersection(by_first):
+            candidates.update(by_first[char])
+
+        for i in sorted(candidates):
+            pattern, responses = custom_rules[i]
+            try:
+                if pattern.search(message, timeout=_CUSTOM_RULE_TIMEOUT):
+                    return responses
+            except TimeoutError:
+                continue
+
+        return None
+
+    return match
+
+
+# Matchers for the built-in rule sets, specialized once at import
+_TEMPLATE_MATCHERS = {template: _compile_template(rules) for template, rules in _MERGED_RULES.items()}
+
+
+# Custom rule sets are per-session, so bound how many compiled sets are kept
+@st.cache_resource(max_entries=64, ttl=3600)
+def get_rule_matcher(
+    template: Optional[str],
+    custom_rules_key: Tuple[Tuple[str, str], ...]
+) -> Callable[[str], Optional[List[str]]]:
+    """Build the matcher for a template and custom rules once per process."""
+    if not custom_rules_key:
+        return _TEMPLATE_MATCHERS[template]
+
+    # Custom rules are arbitrary user regex (groups, backreferences), so they
+    # are matched one by one after the built-in rules
+    custom_rules = [
+        (regex.compile(pattern, regex.IGNORECASE), [response])
+        for pattern, response in custom_rules_key
+    ]
+    return _compile_template(_MERGED_RULES[template], custom_rules)
+
+
+def _rules_key(template: Optional[str], custom_rules: Optional[List[Dict]]) -> Tuple:
+    """Key identifying a template and custom rule set, as used by get_rule_matcher."""
+    if template not in CHATBOT_TEMPLATES:
+        template = None
+    return (
+        template,
+        tuple((custom_rule["pattern"], custom_rule["response"]) for custom_rule in custom_rules or [])
+    )
+
+
 class RuleBasedChatbot:
     """Simple rule-based chatbot using pattern matching."""
 
-    def __init__(self, template=None):
-        # Default rules
-        default_rules = {
-            r'\b(hello|hi|hey)\b': [
-                "Hello! How can I help you today?",
-                "Hi there! What can I do for you?",
-                "Hey! How's it going?"
-            ],
-            r'\b(bye|goodbye|see you)\b': [
-                "Goodbye! Have a great day!",
-                "See you later!",
-                "Take care!"
-            ],
-            r'\bname\b': [
-                "I'm a rule-based chatbot created to help you learn!",
-                "My name is RuleBot. Nice to meet you!"
-            ],
-            r'\b(thanks|thank you)\b': [
-                "You're welcome!",
-                "Happy to help!",
-                "No problem!"
-            ],
-            r'\b(help|what can you do)\b': [
-                "I can respond to basic greetings, questions about my name, and simple conversations!",
-                "I'm a simple rule-based bot. Try saying hello, asking my name, or saying goodbye!"
-            ]
-        }
+    def __init__(self, template=None, custom_rules=None):
+        # The compiled matcher is process-wide; the bot only keeps its cache key
+        self.rules_key = _rules_key(template, custom_rules)
 
         # Load template if provided
-        if template and template in CHATBOT_TEMPLATES:
-            template_data = CHATBOT_TEMPLATES[template]
-            self.rules = {**default_rules, **template_data["rules"]}
-            self.name = template_data["name"]
-        else:
-            self.rules = default_rules
-            self.name = "RuleBot"
-
-        self.default_responses = [
-            "I'm not sure I understand. Can you rephrase that?",
-            "That's interesting! Tell me more.",
-            "I'm still learning. Can you ask me something else?",
-            "Hmm, I don't have a good response for that yet."
-        ]
+        template = self.rules_key[0]
+        self.name = CHATBOT_TEMPLATES[template]["name"] if template else "RuleBot"
+
+        self.default_responses = _DEFAULT_RESPONSES
+
+        # Per-bot generator so sessions don't share the module-level random state
+        self._rng = random.Random()
 
     def get_response(self, message: str) -> str:
         """Get response based on pattern matching."""
-        message_lower = message.lower()
+        if not message.strip():
+            return self._rng.choice(self.default_responses)
+
+        # Rules look for short phrases, so only the start of a long message is matched
+        matcher = get_rule_matcher(*self.rules_key)
+        responses = matcher(message[:MAX_MESSAGE_LENGTH])
+        return self._rng.choice(responses or self.default_responses)
+
+
+# System prompts for each AI bot personality
+PERSONALITY_PROMPTS = {
+    "helpful": "You are a helpful and friendly assistant. Provide clear, useful responses.",
+    "creative": "You are a creative and imaginative assistant. Use vivid language and creative examples.",
+    "professional": "You are a professional business assistant. Be formal and direct in your responses.",
+    "funny": "You are a witty and humorous assistant. Add appropriate humor to your responses.",
+    "educational": "You are an educational tutor. Explain concepts clearly and ask follow-up questions."
+}
+
+
+# Users can enter their own API keys, so bound how many clients (and pools) are kept
+@st.cache_resource(max_entries=16, ttl=3600)
+def _get_openai_client(api_key: str) -> "OpenAI":
+    """Create one OpenAI client per API key and reuse its connection pool."""
+    # Imported here so rule-based sessions never pay for loading openai
+    from openai import OpenAI
 
-        for pattern, responses in self.rules.items():
-            if re.search(pattern, message_lower):
-                return random.choice(responses)
+    return OpenAI(api_key=api_key)
 
-        return random.choice(self.default_responses)
+
+# Batch statuses after which no more results will arrive
+_BATCH_FINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
 
 
 class AIChatbot:
     """AI-powered chatbot using OpenAI."""
 
     def __init__(self, personality: str = "helpful"):
-        self.personality_prompts = {
-            "helpful": "You are a helpful and friendly assistant. Provide clear, useful responses.",
-            "creative": "You are a creative and imaginative assistant. Use vivid language and creative examples.",
-            "professional": "You are a professional business assistant. Be formal and direct in your responses.",
-            "funny": "You are a witty and humorous assistant. Add appropriate humor to your responses.",
-            "educational": "You are an educational tutor. Explain concepts clearly and ask follow-up questions."
-        }
-
         self.personality = personality
         self.client = None
+        self.last_batch = None
 
         # Try to initialize OpenAI client
-        api_key = os.getenv("OPENAI_API_KEY")
-        if api_key and api_key != "sk-default-key":
-            self.client = OpenAI(api_key=api_key)
+        self.api_key = os.getenv("OPENAI_API_KEY")
+        if self.api_key and self.api_key != "sk-default-key":
+            self.client = _get_openai_client(self.api_key)
 
-    def get_response(self, message: str, context: List[Dict] = None) -> str:
-        """Get AI-powered response."""
+    def get_response(self, message: str, context: List[Dict] = None) -> Iterator[str]:
+        """Stream AI-powered response as text chunks."""
         if not self.client:
-            return "🔑 Please add your OpenAI API key in the sidebar to use the AI chatbot!"
+            yield "🔑 Please add your OpenAI API key in the sidebar to use the AI chatbot!"
+            return
 
         try:
             # Prepare system prompt
-            system_prompt = self.personality_prompts.get(
+            system_prompt = PERSONALITY_PROMPTS.get(
                 self.personality,
-                self.personality_prompts["helpful"]
+                PERSONALITY_PROMPTS["helpful"]
             )
 
             # Prepare messages
@@ -191,18 +820,197 @@ class AIChatbot:
 
             messages.append({"role": "user", "content": message})
 
-            # Get response from OpenAI
-            response = self.client.chat.completions.create(
+            # Stream response from OpenAI
+            stream = self.client.chat.completions.create(
                 model="gpt-5",  # the newest OpenAI model is "gpt-5" which was released August 7, 2025
                 messages=messages,
                 max_tokens=200,
-                temperature=0.7
+                temperature=0.7,
+                stream=True
             )
 
-            return response.choices[0].message.content
+            for chunk in stream:
+                if chunk.choices:
+                    yield chunk.choices[0].delta.content or ""
 
         except Exception as e:
-            return f"Sorry, I encountered an error: {str(e)}. Please check your API key."
+            yield f"Sorry, I encountered an error: {str(e)}. Please check your API key."
+
+    def batch_respond(
+        self,
+        messages_list: List[str],
+        poll_interval: float = 10.0,
+        max_wait: float = 300.0
+    ) -> Dict[str, str]:
+        """Answer many prompts through the OpenAI Batch API, keyed by custom_id.
+
+        Stops polling after max_wait seconds; prompts without a result yet are
+        reported as pending with the batch id, and the batch keeps running. If the
+        batch ended without a result for a prompt, its errors are reported instead.
+        """
+        self.last_batch = None
+        if not self.client:
+            return {}
+
+        system_prompt = PERSONALITY_PROMPTS.get(
+            self.personality,
+            PERSONALITY_PROMPTS["helpful"]
+        )
+
+        # One request per line; custom_id ties each result back to its prompt
+        requests = []
+        for i, message in enumerate(messages_list):
+            requests.append(json.dumps({
+                "custom_id": f"prompt-{i}",
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": {
+                    "model": "gpt-5",
+                    "messages": [
+                        {"role": "system", "content": system_prompt},
+                        {"role": "user", "content": message}
+                    ],
+                    "max_tokens": 200,
+                    "temperature": 0.7
+                }
+            }))
+
+        batch_file = self.client.files.create(
+            file=("batch_input.jsonl", "\n".join(requests).encode("utf-8")),
+            purpose="batch"
+        )
+        batch = self.client.batches.create(
+            input_file_id=batch_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h"
+        )
+
+        # Batches run asynchronously, so poll until they reach a final state or
+        # the deadline passes
+        deadline = time.monotonic() + max_wait
+        while batch.status not in _BATCH_FINAL_STATUSES and time.monotonic() < deadline:
+            time.sleep(min(poll_interval, max(0.0, deadline - time.monotonic())))
+            batch = self.client.batches.retrieve(batch.id)
+        self.last_batch = batch
+
+        # Successful requests land in the output file, failed ones in the error file
+        results = {}
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if not file_id:
+                continue
+
+            for line in self.client.files.content(file_id).text.splitlines():
+                result = json.loads(line)
+                response = result.get("response") or {}
+                body = response.get("body") or {}
+
+                if response.get("status_code") == 200:
+                    results[result["custom_id"]] = body["choices"][0]["message"]["content"]
+                else:
+                    error = result.get("error") or body.get("error") or {}
+                    results[result["custom_id"]] = f"Sorry, I encountered an error: {error.get('message', 'unknown error')}."
+
+        if batch.status not in _BATCH_FINAL_STATUSES:
+            missing = f"⏳ Still pending in batch {batch.id} (status: {batch.status})."
+        else:
+            # Failed, expired or cancelled batches may not produce a result per prompt
+            errors = getattr(batch.errors, "data", None) or []
+            reason = "; ".join(error.message for error in errors if error.message) or "no result returned"
+            missing = f"Sorry, batch {batch.id} {batch.status}: {reason}."
+
+        for i in range(len(messages_list)):
+            results.setdefault(f"prompt-{i}", missing)
+
+        return results
+
+
+# Static Learning Center content
+_TUTORIAL_BOT_TYPES = """
+**Rule-Based Bots:**
+- Use pattern matching
+- Fast and predictable
+- Limited to predefined responses
+- Great for simple tasks
+
+**AI-Powered Bots:**
+- Use machine learning models
+- More natural conversations
+- Can handle complex queries
+- Require API keys/costs
+
+**Hybrid Bots:**
+- Combine both approaches
+- Rule-based for common queries
+- AI for complex requests
+"""
+
+_TUTORIAL_RULE_BASED = """
+```python
+# Pattern matching example
+import re
+
+# Compile once; IGNORECASE saves lowercasing every message
+HELLO = re.compile(r'\\bhello\\b', re.IGNORECASE)
+BYE = re.compile(r'\\bbye\\b', re.IGNORECASE)
+
+def get_response(message):
+    if HELLO.search(message):
+        return "Hello! How can I help?"
+    elif BYE.search(message):
+        return "Goodbye!"
+    else:
+        return "I don't understand."
+```
+"""
+
+_TUTORIAL_AI = """
+```python
+# AI chatbot example
+from openai import OpenAI
+
+client = OpenAI(api_key="your-key")
+
+response = client.chat.completions.create(
+    model="gpt-5",
+    messages=[
+        {"role": "system", "content": "You are helpful"},
+        {"role": "user", "content": user_message}
+    ]
+)
+```
+"""
+
+_TUTORIAL_BEST_PRACTICES = """
+**For Rule-Based Bots:**
+- Start with common user intents
+- Use regex for flexible matching
+- Provide fallback responses
+- Test edge cases
+
+**For AI Bots:**
+- Write clear system prompts
+- Manage conversation context
+- Handle API errors gracefully
+- Set appropriate temperature
+
+**General Tips:**
+- Keep responses concise
+- Add personality consistently
+- Test with real users
+- Monitor and improve
+"""
+
+
+def get_ai_bot() -> AIChatbot:
+    """Return the session's AI bot, rebuilding it when the personality or API key changes."""
+    bot = st.session_state.ai_bot
+    if (bot is None
+            or bot.personality != st.session_state.bot_personality
+            or bot.api_key != os.getenv("OPENAI_API_KEY")):
+        bot = AIChatbot(st.session_state.bot_personality)
+        st.session_state.ai_bot = bot
+
+    return bot
 
 
 def main():
@@ -277,8 +1085,25 @@ def main():
             response = st.text_input("Response:", placeholder="e.g., I love talking about food!")
 
             if st.button("Add Rule") and pattern and response:
-                st.session_state.custom_rules.append({"pattern": pattern, "response": response})
-                st.success("Rule added!")
+                reason = _validate_pattern(pattern)
+                if reason:
+                    st.error(f"Pattern rejected: {reason}. Try a simpler one.")
+                else:
+                    try:
+                        _compile_custom_pattern(pattern)
+                    except regex.error as e:
+                        st.error(f"Invalid pattern: {e}")
+                    except TimeoutError:
+                        st.error("This pattern is too slow to match safely. Try a simpler one.")
+                    else:
+                        st.session_state.custom_rules.append(
+                            {"pattern": pattern, "response": response}
+                        )
+                        if _parse_for_lint(pattern) is None:
+                            st.success("Rule added! Its syntax is beyond the safety check, "
+                                       "so it is only guarded by the match timeout.")
+                        else:
+                            st.success("Rule added!")
 
         elif bot_type == "custom":
             st.subheader("Custom Bot Builder")
@@ -286,7 +1111,11 @@ def main():
 
         # Clear conversation
         if st.button("🗑️ Clear Conversation"):
-            st.session_state.messages = []
+            st.session_state.store.clear()
+            st.session_state.history_window = HISTORY_WINDOW
+            st.session_state.user_count = 0
+            st.session_state.bot_count = 0
+            st.session_state.context.clear()
             st.rerun()
 
     # Main content area
@@ -299,8 +1128,13 @@ def main():
         chat_container = st.container()
 
         with chat_container:
+            # Older messages are loaded from the store only on request
+            if len(st.session_state.store) > st.session_state.history_window:
+                if st.button("⬆️ Load earlier messages"):
+                    st.session_state.history_window += HISTORY_WINDOW
+
             # Display chat history
-            for message in st.session_state.messages:
+            for message in st.session_state.store.tail(st.session_state.history_window):
                 if message["role"] == "user":
                     with st.chat_message("user"):
                         st.markdown(message["content"])
@@ -313,123 +1147,102 @@ def main():
 
         if user_input:
             # Add user message
-            st.session_state.messages.append({"role": "user", "content": user_input})
+            user_message = {"role": "user", "content": user_input}
+            st.session_state.store.append(user_message)
+            st.session_state.user_count += 1
 
             # Get bot response based on type
             if st.session_state.current_bot == "rule_based":
-                bot = RuleBasedChatbot()
-
-                # Add custom rules
-                for custom_rule in st.session_state.custom_rules:
-                    bot.rules[custom_rule["pattern"]] = [custom_rule["response"]]
+                # Rebuild the bot only when the template or custom rules have changed
+                template = st.session_state.selected_template
+                custom_rules = st.session_state.custom_rules
+                bot = st.session_state.rule_bot
+                if bot is None or bot.rules_key != _rules_key(template, custom_rules):
+                    bot = RuleBasedChatbot(template=template, custom_rules=custom_rules)
+                    st.session_state.rule_bot = bot
 
                 response = bot.get_response(user_input)
 
             elif st.session_state.current_bot == "ai_powered":
-                bot = AIChatbot(st.session_state.bot_personality)
-
-                # Convert messages to OpenAI format
-                context = []
-                for msg in st.session_state.messages[-10:]:  # Last 10 messages
-                    if msg["role"] in ["user", "assistant"]:
-                        context.append(msg)
-
-                response = bot.get_response(user_input, context)
+                bot = get_ai_bot()
+                response = bot.get_response(user_input, list(st.session_state.context))
 
             else:  # custom
                 response = "🚧 Custom bot functionality coming soon!"
 
+            # Render the new turn in place instead of rerunning the whole script
+            with chat_container:
+                with st.chat_message("user"):
+                    st.markdown(user_input)
+                with st.chat_message("assistant"):
+                    if isinstance(response, str):
+                        st.markdown(response)
+                    else:
+                        # AI replies are streamed as they arrive
+                        response = st.write_stream(response)
+
             # Add bot response
-            st.session_state.messages.append({"role": "assistant", "content": response})
-            st.rerun()
+            bot_message = {"role": "assistant", "content": response}
+            st.session_state.store.append(bot_message)
+            st.session_state.bot_count += 1
+
+            # The user turn joins the context only now so it isn't sent twice
+            st.session_state.context.append(user_message)
+            st.session_state.context.append(bot_message)
+
+        # Bulk prompt evaluation through the Batch API
+        if st.session_state.current_bot == "ai_powered":
+            with st.expander("🧪 Evaluate Prompts"):
+                st.caption("Runs many prompts at once through the OpenAI Batch API. "
+                           "Batches are cheaper but can take a while to finish.")
+                prompts_text = st.text_area("Prompts (one per line):")
+
+                if st.button("Run Evaluation"):
+                    prompts = [line.strip() for line in prompts_text.splitlines() if line.strip()]
+                    bot = get_ai_bot()
+
+                    if not bot.client:
+                        st.warning("🔑 Please add your OpenAI API key in the sidebar to run evaluations!")
+                    elif prompts:
+                        results = {}
+                        with st.spinner("Waiting up to 5 minutes for the batch to complete..."):
+                            try:
+                                results = bot.batch_respond(prompts)
+                            except Exception as e:
+                                st.error(f"Sorry, the batch failed: {str(e)}")
+
+                        batch = bot.last_batch
+                        if batch is not None and batch.status not in _BATCH_FINAL_STATUSES:
+                            st.info(f"Batch {batch.id} is still {batch.status}. "
+                                    "Its results will be available from OpenAI once it finishes.")
+
+                        for i, prompt in enumerate(prompts):
+                            st.markdown(f"**{prompt}**")
+                            st.write(results.get(f"prompt-{i}", "No response returned."))
 
     with col2:
         st.header("📚 Learning Center")
 
         # Tutorial section
         with st.expander("🎓 Chatbot Types", expanded=True):
-            st.markdown("""
-            **Rule-Based Bots:**
-            - Use pattern matching
-            - Fast and predictable
-            - Limited to predefined responses
-            - Great for simple tasks
-
-            **AI-Powered Bots:**
-            - Use machine learning models
-            - More natural conversations
-            - Can handle complex queries
-            - Require API keys/costs
-
-            **Hybrid Bots:**
-            - Combine both approaches
-            - Rule-based for common queries
-            - AI for complex requests
-            """)
+            st.markdown(_TUTORIAL_BOT_TYPES)
 
         with st.expander("⚙️ How Rule-Based Bots Work"):
-            st.markdown("""
-            ```python
-            # Pattern matching example
-            import re
-
-            def get_response(message):
-                if re.search(r'\\bhello\\b', message.lower()):
-                    return "Hello! How can I help?"
-                elif re.search(r'\\bbye\\b', message.lower()):
-                    return "Goodbye!"
-                else:
-                    return "I don't understand."
-            ```
-            """)
+            st.markdown(_TUTORIAL_RULE_BASED)
 
         with st.expander("🧠 How AI Bots Work"):
-            st.markdown("""
-            ```python
-            # AI chatbot example
-            from openai import OpenAI
-
-            client = OpenAI(api_key="your-key")
-
-            response = client.chat.completions.create(
-                model="gpt-5",
-                messages=[
-                    {"role": "system", "content": "You are helpful"},
-                    {"role": "user", "content": user_message}
-                ]
-            )
-            ```
-            """)
+            st.markdown(_TUTORIAL_AI)
 
         with st.expander("🛠️ Best Practices"):
-            st.markdown("""
-            **For Rule-Based Bots:**
-            - Start with common user intents
-            - Use regex for flexible matching
-            - Provide fallback responses
-            - Test edge cases
-
-            **For AI Bots:**
-            - Write clear system prompts
-            - Manage conversation context
-            - Handle API errors gracefully
-            - Set appropriate temperature
-
-            **General Tips:**
-            - Keep responses concise
-            - Add personality consistently
-            - Test with real users
-            - Monitor and improve
-            """)
+            st.markdown(_TUTORIAL_BEST_PRACTICES)
 
         # Quick stats
         st.subheader("📊 Chat Stats")
-        total_messages = len(st.session_state.messages)
-        user_messages = len([m for m in st.session_state.messages if m["role"] == "user"])
-        bot_messages = len([m for m in st.session_state.messages if m["role"] == "assistant"])
+        user_messages = st.session_state.user_count
+        bot_messages = st.session_state.bot_count
 
         col_a, col_b, col_c = st.columns(3)
-        col_a.metric("Total", total_messages)
+        col_a.metric("Total", user_messages + bot_messages)
         col_b.metric("User", user_messages)
         col_c.metric("Bot", bot_messages)
 